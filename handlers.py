@@ -0,0 +1,180 @@
+"""
+Shared crawl logic used by the endpoints: context creation, request blocking, navigation,
+scrolling and cookie banner handling. Endpoints only differ in what they do with the page.
+"""
+import json
+import re
+import time
+
+from playwright.async_api import BrowserContext, Page, TimeoutError as PlaywrightTimeoutError
+
+from models import CrawlRequest
+from services import PlaywrightService
+
+# Upper bound on scrolling through the page, on top of the request timeout (ms)
+SCROLL_TIMEOUT = 5000
+
+# Upper bound on waiting for lazy-loaded content to settle after scrolling (ms)
+SCROLL_IDLE_TIMEOUT = 2000
+
+# Scrolls a viewport at a time to trigger lazy loading, finishing as soon as the bottom is reached,
+# the window stops moving (e.g. scroll-locked or inner-scrolling layouts) or the timeout (ms) runs out
+AUTO_SCROLL_FN = """async (timeout) => {
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+        const previousY = window.scrollY;
+        window.scrollBy(0, window.innerHeight);
+        await sleep(50);
+        if (window.scrollY === previousY || window.scrollY + window.innerHeight >= document.body.scrollHeight) {
+            break;
+        }
+    }
+}"""
+
+# Registered once per pooled context as an init script (see PlaywrightService.create), as a
+# hidden read-only global so each page on it only has to call it
+AUTO_SCROLL_NAME = "__h2pScroll"
+SCROLL_JS = f"""Object.defineProperty(window, "{AUTO_SCROLL_NAME}", {{
+    value: {AUTO_SCROLL_FN},
+    enumerable: false,
+    writable: false,
+    configurable: false,
+}});"""
+
+# Resolves to false instead of throwing when the init script did not run for the document
+SCROLL_CALL_JS = f"""async (timeout) => {{
+    const scroll = window["{AUTO_SCROLL_NAME}"];
+    if (typeof scroll !== "function") {{
+        return false;
+    }}
+    await scroll(timeout);
+    return true;
+}}"""
+
+# How long to wait for the cookie banner to appear and become clickable (ms)
+ACCEPT_COOKIES_TIMEOUT = 500
+
+BLOCKED_MEDIA_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "svg", "mp3", "mp4", "avi", "flac", "ogg", "wav", "webm")
+# Compiled once here instead of Playwright translating a glob on every request
+BLOCKED_MEDIA_RE = re.compile(rf"\.({'|'.join(BLOCKED_MEDIA_EXTENSIONS)})(\?|$)", re.IGNORECASE)
+
+
+def build_proxy(body: CrawlRequest, default_proxy: dict | None = None):
+    """Build the Playwright proxy settings from the request, falling back to the default proxy."""
+    if body.proxy:
+        return {
+            "server": f"{body.proxy.type}://{body.proxy.host}:{body.proxy.port}",
+            "username": body.proxy.username,
+            "password": body.proxy.password,
+        }
+    return default_proxy
+
+
+async def suppress_client_hints(context: BrowserContext, page: Page, user_agent_override: dict):
+    """
+    Stop Chromium sending sec-ch-ua headers from the page and its cross-site iframes.
+
+    Overriding the user agent without userAgentMetadata disables client hints. The override only
+    lasts as long as the CDP session, so the session stays attached until the page is closed.
+    Cross-site iframes run in their own targets, they are auto-attached paused so the override is
+    in place before their first request. Iframes nested inside those are not covered.
+    """
+    client = await context.new_cdp_session(page)
+    await client.send("Emulation.setUserAgentOverride", user_agent_override)
+
+    async def on_attached(event):
+        # Playwright does not expose flattened child sessions, so drive the child through this one
+        for message_id, method, params in (
+            (1, "Emulation.setUserAgentOverride", user_agent_override),
+            # Always resume the target, its navigation is held until every auto-attached client does
+            (2, "Runtime.runIfWaitingForDebugger", {}),
+        ):
+            try:
+                await client.send("Target.sendMessageToTarget", {
+                    "sessionId": event["sessionId"],
+                    "message": json.dumps({"id": message_id, "method": method, "params": params}),
+                })
+            except Exception:
+                # The page or the target went away in the meantime
+                pass
+
+    client.on("Target.attachedToTarget", on_attached)
+    await client.send("Target.setAutoAttach", {"autoAttach": True, "waitForDebuggerOnStart": True, "flatten": False})
+
+
+async def run_crawl(service: PlaywrightService, body: CrawlRequest, default_proxy: dict | None = None):
+    """
+    Lease a context, open a page, navigate to the requested URL and prepare the page for capture.
+
+    Args:
+        service (PlaywrightService): The service providing the browser.
+        body (CrawlRequest): The request body containing the URL and other parameters.
+        default_proxy (dict | None): Proxy settings to use when the request does not specify one.
+
+    Returns:
+        A (page, response, context) tuple, the caller must close the page and then release
+        the context with service.close_context() once done.
+    """
+    context = await service.new_context(
+        user_agent=body.user_agent or None,
+        # viewport={"width": 1280, "height": 720},
+        locale=body.locale or None,
+        extra_http_headers=body.extra_headers or None,
+        proxy=build_proxy(body, default_proxy)
+    )
+    page = None
+    try:
+        page = await context.new_page()
+        if service.engine == "chromium":
+            user_agent_override = {"userAgent": body.user_agent or service.user_agent}
+            if body.locale:
+                user_agent_override["acceptLanguage"] = body.locale
+            await suppress_client_hints(context, page, user_agent_override)
+        if body.block_media:
+            # Routed on the page, pooled contexts would otherwise gain a handler per request.
+            # Only URLs matching the pattern are sent to Python, unlike Network events on a CDP session
+            await page.route(
+                BLOCKED_MEDIA_RE,
+                handler=lambda route, request: route.abort(),
+            )
+
+        response = await page.goto(
+            body.url,
+            wait_until="domcontentloaded",
+            timeout=body.timeout,
+        )
+
+        if body.wait_after_load:
+            await page.wait_for_timeout(body.wait_after_load)
+
+        # Scrolling and waiting for it to settle share the request timeout, so infinite-scroll
+        # pages stop when it runs out
+        scroll_deadline = time.monotonic() + body.timeout / 1000
+        scroll_timeout = min(body.timeout, SCROLL_TIMEOUT)
+        if service.context_pool_size <= 0 or not await page.evaluate(SCROLL_CALL_JS, scroll_timeout):
+            # Fresh contexts have no init script, so send the function itself
+            await page.evaluate(AUTO_SCROLL_FN, scroll_timeout)
+
+        idle_timeout = min(round((scroll_deadline - time.monotonic()) * 1000), SCROLL_IDLE_TIMEOUT)
+        if idle_timeout > 0:
+            try:
+                await page.wait_for_load_state("networkidle", timeout=idle_timeout)
+            except PlaywrightTimeoutError:
+                pass
+
+        if body.accept_cookies_selector:
+            try:
+                await page.locator(body.accept_cookies_selector).first.click(timeout=ACCEPT_COOKIES_TIMEOUT)
+            except Exception:
+                # No banner, an invalid selector or the page navigated away, carry on without the click
+                pass
+    except Exception:
+        try:
+            if page:
+                await page.close()
+        finally:
+            await service.close_context(context)
+        raise
+
+    return page, response, context
@@ -8,11 +8,12 @@ from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.logger import logger
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.security import APIKeyHeader
+from handlers import SCROLL_JS, run_crawl
 from models import CrawlRequest, HealthResponse
-from services import PlaywrightService, remove_sec_ch_ua
-from utils import parse_proxy_env
+from services import PlaywrightService
+from utils import proxy_settings
 
 load_dotenv()
 
@@ -27,8 +28,23 @@ api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 AUTH_API_KEY = os.environ.get("AUTH_API_KEY")
 ENGINE = os.environ.get("ENGINE", "chromium")
 DEFAULT_PROXY = os.environ.get('DEFAULT_PROXY', None)
+# Parsed once at startup rather than on every request
+DEFAULT_PROXY_SETTINGS = proxy_settings(DEFAULT_PROXY)
 print(ENGINE)
 
+# Size of the chunks the PDF body is written to the client in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+async def iter_chunks(data: bytes, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield data in chunks so the body is written out a piece at a time.
+
+    Chunks are bytes, the Starlette version pinned by FastAPI only accepts bytes or str. Async so
+    Starlette iterates it on the event loop instead of a threadpool.
+    """
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
 
 async def verify_api_key(api_key: str = Depends(api_key_header)):
     """Verify API key if it's set in environment variables."""
@@ -52,7 +68,7 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
 async def startup_event():
     """Event handler for application startup to initialize the browser."""
     global service
-    service = await PlaywrightService.create()
+    service = await PlaywrightService.create(init_scripts=[SCROLL_JS])
     logger.info("Starting browser with Engine: %s", ENGINE)
     await service.start_browser(engine=ENGINE)
 
@@ -74,21 +90,21 @@ async def lifespan(app: FastAPI):
     await shutdown_event()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 @app.get("/health/liveness", response_model=HealthResponse)
 def liveness_probe():
     """Endpoint for liveness probe."""
-    return JSONResponse(content={"status": "ok"}, status_code=200)
+    return ORJSONResponse(content={"status": "ok"}, status_code=200)
 
 
 @app.get("/health/readiness", response_model=HealthResponse)
 async def readiness_probe():
     """Endpoint for readiness probe. Checks if the browser instance is ready."""
     if service.browser:
-        return JSONResponse(content={"status": "ok"}, status_code=200)
-    return JSONResponse(content={"status": "Service Unavailable"}, status_code=503)
+        return ORJSONResponse(content={"status": "ok"}, status_code=200)
+    return ORJSONResponse(content={"status": "Service Unavailable"}, status_code=503)
 
 
 @app.post("/pdf", responses={
@@ -116,68 +132,10 @@ async def fetch_pdf(body: CrawlRequest):
         The generated PDF bytes
     """
     global service
+    page = None
     context = None
     try:
-
-        proxy = None
-
-        if body.proxy:
-            proxy = {
-                "server": f"{body.proxy.type}://{body.proxy.host}:{body.proxy.port}",
-                "username": body.proxy.username,
-                "password": body.proxy.password,
-            }
-        elif DEFAULT_PROXY:
-            server, username, password = parse_proxy_env(DEFAULT_PROXY)
-            proxy = {
-                "server": server,
-                "username": username,
-                "password": password,
-            }
-
-        context = await service.new_context(
-            user_agent=body.user_agent or None,
-            # viewport={"width": 1280, "height": 720},
-            locale=body.locale or None,
-            extra_http_headers=body.extra_headers or None,
-            proxy=proxy
-        )
-
-        if body.block_media:
-            await context.route(
-                "**/*.{png,jpg,jpeg,gif,svg,mp3,mp4,avi,flac,ogg,wav,webm}",
-                handler=lambda route, request: route.abort(),
-            )
-
-        page = await context.new_page()
-        if ENGINE == "chromium":
-            await page.route("**/*", remove_sec_ch_ua)
-
-        response = await page.goto(
-            body.url,
-            wait_until="domcontentloaded",
-            timeout=body.timeout,
-        )
-
-        if body.wait_after_load:
-            await page.wait_for_timeout(body.wait_after_load)
-
-        scroll_height = await page.evaluate("""() => {
-    const step = 50;
-    let scrollInterval = setInterval(() => {
-        window.scrollBy(0, step);
-    }, 10);
-    return document.body.scrollHeight;
-};""")
-
-        await page.wait_for_timeout(scroll_height / 5)
-
-        try:
-            if body.accept_cookies_selector:
-                element = await page.wait_for_selector(body.accept_cookies_selector, timeout=2000)
-                await element.click()
-        except:
-            pass
+        page, _, context = await run_crawl(service, body, DEFAULT_PROXY_SETTINGS)
 
         options = {}
         if body.pdf_options:
@@ -189,20 +147,25 @@ async def fetch_pdf(body: CrawlRequest):
             await page.emulate_media(media=body.media_type)
         pdf = await page.pdf(**options)
 
-        return Response(
-            pdf,
+        return StreamingResponse(
+            iter_chunks(pdf),
             media_type="application/pdf",
             headers={
-                "Content-Disposition": 'attachment; filename="page.pdf"'
+                "Content-Disposition": 'attachment; filename="page.pdf"',
+                "Content-Length": str(len(pdf)),
             }
         )
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return JSONResponse(
+        return ORJSONResponse(
             content={"error": str(e)}, status_code=500
         )
     finally:
-        if context:
-            await context.close()
+        try:
+            if page:
+                await page.close()
+        finally:
+            if context:
+                await service.close_context(context)
@@ -1,37 +1,223 @@
+import asyncio
+import os
+from collections import OrderedDict
+
 from playwright.async_api import async_playwright
 
+BROWSER_ARGS = ["--no-sandbox", "--disable-dev-shm-usage"]
+
+
+def _freeze(value):
+    """Turn context options into a hashable pool key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
 
 class PlaywrightService:
-    def __init__(self, playwright):
+    def __init__(self, playwright, init_scripts=()):
         self.playwright = playwright
         self.browser = None
+        self.engine = None
+        self.user_agent = None
+        self.init_scripts = list(init_scripts)
+        # Read here rather than at import so values loaded from .env by main.py are picked up
+        self.max_contexts_per_browser = int(os.environ.get("MAX_CONTEXTS_PER_BROWSER", "200"))
+        # Context reuse is opt-in, pooled contexts share cookies and storage between requests
+        self.context_pool_size = int(os.environ.get("CONTEXT_POOL_SIZE", "0"))
+        self.context_max_uses = int(os.environ.get("CONTEXT_MAX_USES", "50"))
+        self._lock = asyncio.Lock()
+        self._context_count = 0
+        # Open contexts per browser, so a rotated-out browser is only closed once drained
+        self._open_contexts = {}
+        self._retired_browsers = set()
+        # Reusable contexts keyed on their options, least recently used first
+        self._pool = OrderedDict()
+        self._contexts = {}
 
     @classmethod
-    async def create(cls):
+    async def create(cls, init_scripts=()):
         playwright = await async_playwright().start()
-        return cls(playwright=playwright)
+        return cls(playwright=playwright, init_scripts=init_scripts)
 
-    async def start_browser(self, engine):
+    async def _launch(self, engine):
         if engine == "firefox":
-            self.browser = await self.playwright.firefox.launch(headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"])
-            return self
+            browser_type = self.playwright.firefox
         elif engine == "webkit":
-            self.browser = await self.playwright.webkit.launch(headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"])
-            return self
-        self.browser = await self.playwright.chromium.launch(headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"])
+            browser_type = self.playwright.webkit
+        else:
+            browser_type = self.playwright.chromium
+        browser = await browser_type.launch(headless=True, args=BROWSER_ARGS)
+        user_agent = None
+        try:
+            if engine not in ("firefox", "webkit"):
+                # Default user agent, needed to override it without client hint metadata
+                session = await browser.new_browser_cdp_session()
+                user_agent = (await session.send("Browser.getVersion"))["userAgent"]
+                await session.detach()
+        except Exception:
+            await browser.close()
+            raise
+
+        # Only swap the browser in once it is fully set up, a failed launch leaves the service as it was
+        self._open_contexts[browser] = 0
+        self.engine = engine
+        self.user_agent = user_agent
+        self.browser = browser
+        self._context_count = 0
+
+    async def _relaunch(self):
+        """Replace the browser with a fresh one, Playwright keeps per-context objects alive
+        for the lifetime of the browser connection so this bounds memory growth.
+
+        Returns the idle contexts and drained browsers that were dropped, for the caller to
+        close once the lock is released.
+        """
+        old_browser = self.browser
+        # Launch first, if it fails the pool is left intact on the still-current browser
+        await self._launch(self.engine)
+        contexts, browsers = [], []
+        while self._pool:
+            _, context = self._pool.popitem(last=False)
+            if not self._contexts[context]["leases"]:
+                self._forget_context(context)
+                contexts.append(context)
+        if self._open_contexts[old_browser]:
+            self._retired_browsers.add(old_browser)
+        else:
+            del self._open_contexts[old_browser]
+            browsers.append(old_browser)
+        return contexts, browsers
+
+    async def _close_browser(self, browser):
+        self._open_contexts.pop(browser, None)
+        self._retired_browsers.discard(browser)
+        await browser.close()
+
+    async def start_browser(self, engine):
+        async with self._lock:
+            if self.browser is None:
+                await self._launch(engine)
         return self
 
     async def stop(self):
-        if self.browser:
-            await self.browser.close()
-            self.browser = None
+        async with self._lock:
+            self._pool.clear()
+            self._contexts.clear()
+            for browser in list(self._retired_browsers):
+                await self._close_browser(browser)
+
+            if self.browser:
+                await self._close_browser(self.browser)
+                self.browser = None
 
         await self.playwright.stop()
 
     async def new_context(self, **kwargs):
-        return await self.browser.new_context(**kwargs)
+        """Lease a context, reusing a pooled one created with the same options so connections,
+        TLS sessions and the HTTP cache carry over between requests to the same hosts.
+
+        The context must be released with close_context(), pages opened on it should be closed first.
+        """
+        key = _freeze(kwargs)
+        # Only (re)launches and bookkeeping happen under the lock, contexts are created and
+        # closed outside it so requests don't queue behind each other's Playwright calls
+        async with self._lock:
+            if self.browser is None:
+                await self._launch(self.engine)
+            context = self._pool.get(key)
+            if context is not None:
+                self._pool.move_to_end(key)
+                self._lease(key, context)
+                return context
+
+            retired = ((), ())
+            self._context_count += 1
+            if self._context_count > self.max_contexts_per_browser:
+                retired = await self._relaunch()
+                self._context_count = 1
+            browser = self.browser
+            self._open_contexts[browser] += 1
+        await self._close(*retired)
+
+        try:
+            context = await browser.new_context(**kwargs)
+            try:
+                # Only worth the extra round-trip when the context can be reused
+                for script in self.init_scripts if self.context_pool_size > 0 else ():
+                    await context.add_init_script(script)
+            except Exception:
+                await context.close()
+                raise
+        except Exception:
+            async with self._lock:
+                drained = self._release_browser(browser)
+            await self._close(browsers=[drained] if drained else ())
+            raise
+
+        evicted, drained = [], []
+        async with self._lock:
+            self._contexts[context] = {"key": key, "browser": browser, "leases": 0, "uses": 0}
+            # Stop reusing a context that went away underneath us, e.g. a crashed browser
+            context.on("close", lambda _: self._unpool(key, context))
+
+            # Another request may have pooled a context for the same options, or the browser
+            # been rotated out, while this one was being created
+            if self.context_pool_size > 0 and key not in self._pool and browser is self.browser:
+                self._pool[key] = context
+                while len(self._pool) > self.context_pool_size:
+                    _, idle = self._pool.popitem(last=False)
+                    if not self._contexts[idle]["leases"]:
+                        evicted.append(idle)
+                        drained_browser = self._forget_context(idle)
+                        if drained_browser:
+                            drained.append(drained_browser)
+            self._lease(key, context)
+        await self._close(evicted, drained)
+        return context
+
+    def _lease(self, key, context):
+        state = self._contexts[context]
+        state["leases"] += 1
+        state["uses"] += 1
+        if state["uses"] >= self.context_max_uses:
+            # Stop handing it out, it is closed once the current leases are released
+            self._unpool(key, context)
+
+    def _unpool(self, key, context):
+        if self._pool.get(key) is context:
+            del self._pool[key]
+
+    async def close_context(self, context):
+        """Release a leased context, it is closed once it is out of the pool and no longer in use."""
+        async with self._lock:
+            state = self._contexts.get(context)
+            if state is None:
+                return
+            state["leases"] -= 1
+            if state["leases"] or self._pool.get(state["key"]) is context:
+                return
+            drained = self._forget_context(context)
+        await self._close([context], [drained] if drained else ())
+
+    def _forget_context(self, context):
+        """Drop a context from the bookkeeping, returning its browser if that is now drained and should be closed."""
+        return self._release_browser(self._contexts.pop(context)["browser"])
 
+    def _release_browser(self, browser):
+        """Count a context on browser as closed, returning the browser if it was retired and is now drained."""
+        if browser not in self._open_contexts:
+            return None
+        self._open_contexts[browser] -= 1
+        if browser in self._retired_browsers and not self._open_contexts[browser]:
+            del self._open_contexts[browser]
+            self._retired_browsers.discard(browser)
+            return browser
+        return None
 
-async def remove_sec_ch_ua(route):
-    headers = {k: v for k, v in route.request.headers.items() if not k.lower().startswith("sec-ch-ua")}
-    await route.continue_(headers=headers)
+    @staticmethod
+    async def _close(contexts=(), browsers=()):
+        """Close contexts and then browsers, outside the lock as this can take a while. Failures are
+        ignored, a context or browser that can't be closed cleanly has usually crashed already."""
+        await asyncio.gather(*(context.close() for context in contexts), return_exceptions=True)
+        await asyncio.gather(*(browser.close() for browser in browsers), return_exceptions=True)
@@ -0,0 +1,42 @@
+import os
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakePage:
+    def __init__(self, pdf):
+        self._pdf = pdf
+
+    async def pdf(self, **kwargs):
+        return self._pdf
+
+    async def emulate_media(self, **kwargs):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeService:
+    async def close_context(self, context):
+        pass
+
+
+def test_fetch_pdf_streams_whole_pdf(monkeypatch):
+    pdf = b"%PDF-1.7\n" + os.urandom(3 * main.STREAM_CHUNK_SIZE + 123)
+
+    async def run_crawl(service, body, default_proxy=None):
+        return FakePage(pdf), None, object()
+
+    monkeypatch.setattr(main, "run_crawl", run_crawl)
+    monkeypatch.setattr(main, "service", FakeService())
+    monkeypatch.setattr(main, "AUTH_API_KEY", None)
+
+    response = TestClient(main.app).post("/pdf", json={"url": "https://example.com"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.headers["content-length"] == str(len(pdf))
+    assert response.content == pdf
@@ -7,3 +7,15 @@ def parse_proxy_env(uri):
     username = parsed.username
     password = parsed.password
     return server, username, password
+
+
+def proxy_settings(uri):
+    """Parse a proxy URI into Playwright proxy settings, or None if no URI is given."""
+    if not uri:
+        return None
+    server, username, password = parse_proxy_env(uri)
+    return {
+        "server": server,
+        "username": username,
+        "password": password,
+    }